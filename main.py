@@ -1,51 +1,375 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Blueprint, Flask, current_app, request, jsonify, send_from_directory
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
+import orjson
 import requests
-from bs4 import BeautifulSoup
-import json
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from bs4 import BeautifulSoup, SoupStrainer
+from lxml import etree
 import re
-from typing import List, Dict, Tuple, Optional
+from typing import List, Dict, Tuple, Optional, Union
 from datetime import datetime
 import os
+import glob
+import gzip
+import shutil
+import threading
 import time
+import uuid
 import hashlib
+import hmac
+import logging
+import html
+import io
 import pickle
+import tempfile
 from urllib.parse import urljoin
 from dotenv import load_dotenv
 import asyncio
-import aiohttp
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import atexit
+from functools import lru_cache
+from operator import itemgetter
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FuturesTimeoutError
 
 # Load environment variables from .env file
 load_dotenv()
 
-# --- Flask App Initialization ---
-app = Flask(__name__)
-CORS(app)
+logging.basicConfig(level=os.getenv('LOG_LEVEL', 'INFO').upper())
+logger = logging.getLogger(__name__)
+
+# --- JSON Provider ---
+class ORJSONProvider(JSONProvider):
+    """Route Flask's jsonify/request.json through orjson instead of the stdlib json module"""
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
+
+# --- Request Preferences ---
+# Order defines the bit position of each toggle in the packed preference flags
+_PREFERENCE_FLAGS = ('vegetarian', 'vegan', 'exclude_beef', 'exclude_pork', 'prioritize_protein')
+
+
+# --- Campus Lookup ---
+# Every campus is served by the same PSU menu form; _BASE_DIR/_BASE_ORIGIN let resolve_url skip urljoin
+_BASE_URL = "https://www.absecom.psu.edu/menus/user-pages/daily-menu.cfm"
+_BASE_DIR = _BASE_URL.rsplit('/', 1)[0] + '/'
+_BASE_ORIGIN = _BASE_URL[:_BASE_URL.index('/', len('https://'))]
+
+# Search terms matched against the PSU campus dropdown for each of our campus keys
+_CAMPUS_SEARCH_TERMS = {
+    'altoona-port-sky': ('altoona', 'port sky'),
+    'beaver-brodhead': ('beaver', 'brodhead'),
+    'behrend-brunos': ('behrend', 'bruno'),
+    'behrend-dobbins': ('behrend', 'dobbins'),
+    'berks-tullys': ('berks', 'tully'),
+    'brandywine-blue-apple': ('brandywine', 'blue apple'),
+    'greater-allegheny-cafe-metro': ('greater allegheny', 'cafe metro'),
+    'harrisburg-stacks': ('harrisburg', 'stacks'),
+    'harrisburg-outpost': ('harrisburg', 'outpost'),
+    'hazleton-highacres': ('hazleton', 'highacres'),
+    'mont-alto-mill': ('mont alto', 'mill'),
+    'up-east-findlay': ('east', 'findlay'),
+    'up-north-warnock': ('north', 'warnock'),
+    'up-pollock': ('pollock',),
+    'up-south-redifer': ('south', 'redifer'),
+    'up-west-waring': ('west', 'waring'),
+}
+
+
+# --- Precompiled Patterns ---
+_GEMINI_ERROR_RE = re.compile(r'Gemini API|503|Service Unavailable')
+_CACHE_SLUG_RE = re.compile(r'[^a-z0-9]+')
+# Plain-text <a href=...>name</a> links on a meal page, matched on the raw response bytes. Attribute runs skip
+# over quoted values (which may contain '>' or the other quote), and the href may be "...", '...' or unquoted.
+_TAG_ATTRS = rb'(?:[^>"\']|"[^"]*"|\'[^\']*\')*?'
+_ANCHOR_OPEN_RE = re.compile(rb'<a\b' + _TAG_ATTRS + rb'(?<![\w-])href\s*=', re.I)
+_ANCHOR_RE = re.compile(rb'<a\b' + _TAG_ATTRS + rb'(?<![\w-])href\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>"\']+))'
+                        + _TAG_ATTRS + rb'>([^<]{1,200})</a>', re.I)
+_ANCHOR_STRAINER = SoupStrainer('a', href=True)
+# Comments and elements whose content lxml reads as plain text; links inside them are not real links.
+# Whatever is still open after stripping the closed ones (unterminated, '<!-->' etc.) sends the page to lxml.
+_UNPARSED_BLOCK_RE = re.compile(rb'<!--(?!-?>).*?-->|<(script|style|title|textarea|xmp|iframe|noembed|noframes)\b.*?</\1\s*>',
+                                re.I | re.S)
+_UNPARSED_OPEN_RE = re.compile(rb'<!--|<(?:script|style|title|textarea|xmp|iframe|noembed|noframes|plaintext)\b', re.I)
+# Relative hrefs urljoin would leave untouched: plain path segments separated by single '/' or '.', then an
+# optional non-empty query and fragment without whitespace or control characters
+_SIMPLE_HREF_RE = re.compile(r"/?[\w%=&+*!$'(),~-]+(?:[./][\w%=&+*!$'(),~-]+)*"
+                             r"(?:\?[^\x00-\x20\x7f#]+)?(?:#[^\x00-\x20\x7f]+)?")
+
+
+def _keyword_re(keywords: List[str]) -> re.Pattern:
+    """Compile a keyword list into one case-insensitive alternation so matching is a single scan with no lowercased copy"""
+    return re.compile('|'.join(map(re.escape, keywords)), re.IGNORECASE)
+
+
+_NON_FOOD_KEYWORDS = [
+    'select', 'menu', 'date', 'campus', 'print', 'view', 'nutrition', 'allergen',
+    'feedback', 'contact', 'hours', 'location', 'penn state', 'altoona', 
+    'port sky', 'cafe', 'kitchen', 'station', 'grill', 'deli', 'market',
+    'made to order', 'action', 'no items', 'not available', 'closed'
+]
+_PORK_KEYWORDS = ["pork", "bacon", "sausage", "ham"]
+_MEAT_KEYWORDS = ["beef", "pork", "chicken", "turkey", "fish", "salmon", "tuna", "bacon", "sausage", "ham"]
+_ANIMAL_PRODUCT_KEYWORDS = _MEAT_KEYWORDS + ["egg", "eggs", "dairy", "milk", "cheese", "butter", "yogurt"]
+
+_NON_FOOD_RE = _keyword_re(_NON_FOOD_KEYWORDS)
+# Any Unicode letter, and the name lengths accepted as menu items
+_HAS_ALPHA_RE = re.compile(r'[^\W\d_]')
+_MIN_ITEM_NAME_LEN, _MAX_ITEM_NAME_LEN = 3, 70
+
+# Item-name keywords excluded by each dietary toggle in _PREFERENCE_FLAGS
+_EXCLUSION_KEYWORDS = {
+    'vegetarian': _MEAT_KEYWORDS,
+    'vegan': _ANIMAL_PRODUCT_KEYWORDS,
+    'exclude_beef': ["beef"],
+    'exclude_pork': _PORK_KEYWORDS,
+}
+
+
+@lru_cache(maxsize=None)
+def _exclusion_re(preference_flags: int) -> Optional[re.Pattern]:
+    """Compile the exclusion pattern for a flag combination; there are only a few dozen, so each is built once"""
+    keywords = []
+    for i, name in enumerate(_PREFERENCE_FLAGS):
+        if preference_flags >> i & 1:
+            keywords.extend(_EXCLUSION_KEYWORDS.get(name, []))
+    return _keyword_re(list(dict.fromkeys(keywords))) if keywords else None
+
+
+# --- Shared Clients ---
+# Built once at import so warm workers reuse the same connection pool across requests
+_HTTP_SESSION = requests.Session()
+# pool_maxsize covers every _SCRAPE_POOL thread hitting the same host at once.
+# The menu form POST only reads data, so it is retried alongside GET.
+_HTTP_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=16,
+                                            max_retries=Retry(total=3, backoff_factor=0.3,
+                                                              status_forcelist=(429, 502, 503, 504),
+                                                              allowed_methods=('GET', 'POST'))))
+_HTTP_SESSION.headers.update({
+    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36',
+    'Accept-Encoding': 'gzip'
+})
+_GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+_GEMINI_MAX_CONCURRENCY = int(os.getenv('GEMINI_MAX_CONCURRENCY', 3))
+
+# One event loop thread and aiohttp session per worker, so Gemini TLS connections stay warm across requests
+_GEMINI_LOOP_LOCK = threading.Lock()
+_gemini_loop: Optional[asyncio.AbstractEventLoop] = None
+_gemini_session = None
+# Caps Gemini calls in flight across every request and batch on this worker (GEMINI_MAX_CONCURRENCY)
+_gemini_semaphore: Optional[asyncio.Semaphore] = None
+
+_GEMINI_MODEL = "gemini-3.1-flash-preview"
+
+# Gemini calls currently in flight, keyed by prompt digest, so concurrent identical prompts share one call
+_GEMINI_INFLIGHT: Dict[str, Future] = {}
+_GEMINI_INFLIGHT_LOCK = threading.Lock()
+# Finished Gemini scores by the same digest: (monotonic time, results). Guarded by _GEMINI_INFLIGHT_LOCK.
+_GEMINI_RESULTS: Dict[str, Tuple[float, List[Tuple[str, int, str]]]] = {}
+_GEMINI_RESULTS_TTL = 24 * 60 * 60
+_GEMINI_RESULTS_MAX_ENTRIES = 256
+
+# Results and scraped menus live here; clear-cache swaps it out for an empty directory
+_CACHE_DIR = "cache"
+# Bump when the prompt or result format changes so stale cached analyses are ignored
+_CACHE_VERSION = 3
+# Cache files are only ever valid for the day they were written; older ones are pruned in the background
+_CACHE_FILE_TTL = 24 * 60 * 60
+_CACHE_PRUNE_INTERVAL = 60 * 60
+_CACHE_PRUNE_LOCK = threading.Lock()
+_last_cache_prune = float('-inf')
+
+# Worker threads for the I/O-bound menu page fetches, shared by concurrent requests
+_SCRAPE_POOL = ThreadPoolExecutor(max_workers=8)
+
+# Analyses run here so the request thread can enforce a deadline; a late result still lands in the cache
+_ANALYSIS_POOL = ThreadPoolExecutor(max_workers=4)
+_ANALYSIS_TIMEOUT = float(os.getenv('ANALYSIS_TIMEOUT', 25))
+# Prefetch the PSU form page when the app is built; off by default so importing main never touches the network
+_WARM_FORM_CACHE = os.getenv('WARM_FORM_CACHE') == '1'
+# Upper bound on campuses per /api/analyze_batch request, and on the length of one campus key
+_BATCH_MAX_CAMPUSES = 8
+_MAX_CAMPUS_KEY_LEN = 64
+# Analyses currently running, keyed like _RESPONSE_CACHE, so identical concurrent requests wait on one future
+_ANALYSIS_INFLIGHT: Dict[tuple, Future] = {}
+_ANALYSIS_INFLIGHT_LOCK = threading.Lock()
+
+# Parsed form dropdowns from the PSU menu page: 't' is the monotonic fetch time, 'v' the options,
+# 'etag'/'last_modified' the validators used to revalidate with a conditional GET once the TTL expires,
+# 'campus_matches' the campus options paired with each _CAMPUS_SEARCH_TERMS key resolved to (value, name),
+# 'failed_at' the monotonic time of the last failed refresh
+_FORM_CACHE = {'t': 0.0, 'v': None, 'etag': None, 'last_modified': None, 'day': None, 'campus_matches': (None, {}),
+               'failed_at': float('-inf')}
+_FORM_CACHE_TTL = 10 * 60
+# After a failed refresh, requests get whatever copy is cached (possibly none) without retrying the site for this long
+_FORM_CACHE_RETRY_DELAY = 60
+# Held while refreshing so concurrent requests wait for one fetch instead of each downloading the page
+_FORM_CACHE_LOCK = threading.Lock()
+_FORM_SELECT_NAMES = {'selCampus': 'campus', 'selMeal': 'meal', 'selMenuDate': 'date'}
+
+# Scraped menus keyed by campus/date, shared across requests served by this worker. Only the current day's
+# menus are kept; storing one for a new date drops the rest.
+_MENU_CACHE: Dict[str, Dict[str, Dict[str, str]]] = {}
+_MENU_CACHE_LOCK = threading.Lock()
+
+# Serialized /api/analyze bodies keyed by (campus, preference flags, date) -> (created_at, body, etag)
+_RESPONSE_CACHE: Dict[Tuple[str, int, str], Tuple[float, bytes, str]] = {}
+_RESPONSE_CACHE_LOCK = threading.Lock()
+_RESPONSE_CACHE_TTL = 24 * 60 * 60
+_RESPONSE_CACHE_MAX_ENTRIES = 128
+
+
+def _prune_cache_dir():
+    """Delete cache files that are too old to ever be served again"""
+    cutoff = time.time() - _CACHE_FILE_TTL
+    try:
+        with os.scandir(_CACHE_DIR) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    try:
+                        os.remove(entry.path)
+                    except OSError:
+                        pass
+    except FileNotFoundError:
+        pass
+
+
+def _schedule_cache_prune():
+    """Kick off a background prune at most once per _CACHE_PRUNE_INTERVAL per worker"""
+    global _last_cache_prune
+    now = time.monotonic()
+    with _CACHE_PRUNE_LOCK:
+        if now - _last_cache_prune < _CACHE_PRUNE_INTERVAL:
+            return
+        _last_cache_prune = now
+    threading.Thread(target=_prune_cache_dir, daemon=True).start()
+
+
+def _sweep_cache_trash():
+    """Remove cache directories left behind by a clear-cache that was cut off by a worker restart"""
+    for trash_dir in glob.glob(f"{_CACHE_DIR}.trash.*"):
+        shutil.rmtree(trash_dir, ignore_errors=True)
+
+
+threading.Thread(target=_sweep_cache_trash, daemon=True).start()
+
+
+def _get_gemini_loop() -> asyncio.AbstractEventLoop:
+    """Start (once per worker) the background event loop that owns all Gemini I/O"""
+    global _gemini_loop, _gemini_semaphore
+    with _GEMINI_LOOP_LOCK:
+        if _gemini_loop is None:
+            _gemini_semaphore = asyncio.Semaphore(_GEMINI_MAX_CONCURRENCY)
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='gemini-loop', daemon=True).start()
+            atexit.register(_close_gemini_session)
+            _gemini_loop = loop
+    return _gemini_loop
+
+
+def _close_gemini_session():
+    """Close pooled Gemini connections cleanly when the worker exits"""
+    if _gemini_session is not None and not _gemini_session.closed:
+        asyncio.run_coroutine_threadsafe(_gemini_session.close(), _gemini_loop).result(timeout=5)
+
+
+async def _get_gemini_session() -> 'aiohttp.ClientSession':
+    """Return the long-lived Gemini client session; only ever called on the Gemini loop"""
+    global _gemini_session
+    if _gemini_session is None or _gemini_session.closed:
+        # aiohttp is only needed on this path; importing it lazily keeps it off worker boot
+        import aiohttp
+        _gemini_session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=60))
+    return _gemini_session
+
+
+def _form_cache_hit(today) -> bool:
+    """Whether _FORM_CACHE['v'] should be served without a refresh: fresh for today, or the site just failed"""
+    now = time.monotonic()
+    if _FORM_CACHE['v'] and _FORM_CACHE['day'] == today and now - _FORM_CACHE['t'] < _FORM_CACHE_TTL:
+        return True
+    return now - _FORM_CACHE['failed_at'] < _FORM_CACHE_RETRY_DELAY
+
+
+def _match_campus(campus_options: Dict[str, str], terms: Tuple[str, ...]) -> Tuple[Optional[str], str]:
+    """Pick the dropdown entry for a campus's search terms. Returns (value, name) or (None, "")."""
+    # Try to find exact matches first
+    for name, value in campus_options.items():
+        if all(term in name for term in terms):
+            return value, name
+    
+    # Try partial matches
+    for name, value in campus_options.items():
+        if any(term in name for term in terms):
+            return value, name
+    
+    return None, ""
+
+
+def _extract_json(text: str) -> dict:
+    """Parse the model's JSON object, tolerating a ```json fence or prose around it"""
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
+    # Outermost braces; this also drops any code fence, without running a backtracking regex
+    start, end = text.find('{'), text.rfind('}')
+    if start == -1 or end <= start:
+        raise ValueError("No JSON object in Gemini response")
+    return orjson.loads(text[start:end + 1])
+
+
+def _cache_slug(text: str) -> str:
+    """Reduce a campus key or date label to characters that are safe in a cache file name"""
+    return _CACHE_SLUG_RE.sub('-', text.lower()).strip('-')
+
+
+# --- Blueprints ---
+# Routes are attached to blueprints and registered on the single app built by create_app()
+pages_bp = Blueprint('pages', __name__)
+api_bp = Blueprint('api', __name__, url_prefix='/api')
 
 # --- Menu Analyzer Class ---
 class MenuAnalyzer:
+    # One analyzer is built per request (or per campus in a batch); slots drop the per-instance __dict__
+    __slots__ = ('base_url', 'campus_key', 'session', 'debug', 'exclude_beef', 'exclude_pork', 'vegetarian', 'vegan',
+                 'prioritize_protein', 'preference_flags', 'exclusion_re', 'gemini_api_key',
+                 'gemini_url', 'cache_dir', 'menu_complete')
+
     def __init__(self, campus_key: str, gemini_api_key: str = None, exclude_beef=False, exclude_pork=False,
-                 vegetarian=False, vegan=False, prioritize_protein=False, debug=False):
-        self.base_url = "https://www.absecom.psu.edu/menus/user-pages/daily-menu.cfm"
+                 vegetarian=False, vegan=False, prioritize_protein=False, debug=False,
+                 session: Optional[requests.Session] = None):
+        self.base_url = _BASE_URL
         self.campus_key = campus_key
-        self.session = requests.Session()
-        self.session.headers.update({
-            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-        })
+        # Reuse the shared session unless the caller injects its own
+        self.session = session or _HTTP_SESSION
         self.debug = debug
         self.exclude_beef = exclude_beef
         self.exclude_pork = exclude_pork
         self.vegetarian = vegetarian
         self.vegan = vegan
         self.prioritize_protein = prioritize_protein
+        # Same bit layout as the /api/analyze request flags
+        self.preference_flags = sum(bool(getattr(self, name)) << i for i, name in enumerate(_PREFERENCE_FLAGS))
+        # One combined pattern for every enabled restriction, or None when nothing is excluded
+        self.exclusion_re = _exclusion_re(self.preference_flags)
         
         # Use the passed parameter or fall back to environment variable
         self.gemini_api_key = gemini_api_key or os.getenv('GEMINI_API_KEY')
+        self.gemini_url = None
         if self.gemini_api_key:
+            # The key travels in the x-goog-api-key header; aiohttp errors quote the URL, and those reach clients
             self.gemini_url = (
-                f"https://generativelanguage.googleapis.com/v1beta/models/gemini-3.1-flash-preview:generateContent"
-                f"?key={self.gemini_api_key}"
+                f"https://generativelanguage.googleapis.com/v1beta/models/{_GEMINI_MODEL}:streamGenerateContent?alt=sse"
             )
         elif self.debug:
             print("No Gemini API key provided. Using local analysis only.")
@@ -53,24 +377,14 @@ class MenuAnalyzer:
         if self.prioritize_protein and self.debug:
             print("INFO: Analysis is set to prioritize protein content.")
         
-        # Cache directory setup
-        self.cache_dir = "cache"
-        if not os.path.exists(self.cache_dir):
-            os.makedirs(self.cache_dir)
+        # Cache directory setup; it is created on the first write, so building an analyzer touches no files
+        self.cache_dir = _CACHE_DIR
+        # Cleared by run_analysis when a meal page failed to load, so the partial result isn't cached for the day
+        self.menu_complete = True
 
     def get_cache_key(self, date_str: str) -> str:
-        """Generate a cache key based on campus, date, and preferences"""
-        preferences = {
-            'campus': self.campus_key,
-            'exclude_beef': self.exclude_beef,
-            'exclude_pork': self.exclude_pork,
-            'vegetarian': self.vegetarian,
-            'vegan': self.vegan,
-            'prioritize_protein': self.prioritize_protein,
-            'date': date_str
-        }
-        key_string = json.dumps(preferences, sort_keys=True)
-        return hashlib.md5(key_string.encode()).hexdigest()
+        """Generate a cache key based on campus, date, and preferences (packed into two hex digits)"""
+        return f"{_cache_slug(self.campus_key)}_{_cache_slug(date_str)}_{self.preference_flags:02x}"
 
     def get_cached_result(self, date_str: str) -> Optional[Dict[str, List[Tuple[str, int, str, str]]]]:
         """Check if we have cached results for this campus/date/preferences combination"""
@@ -104,73 +418,193 @@ class MenuAnalyzer:
                 'results': results,
                 'timestamp': datetime.now().isoformat()
             }
+            os.makedirs(self.cache_dir, exist_ok=True)
             with open(cache_file, 'wb') as f:
                 pickle.dump(cache_data, f)
             if self.debug:
                 print(f"Cached results for {self.campus_key} on {date_str}")
+            _schedule_cache_prune()
         except Exception as e:
             if self.debug:
                 print(f"Error saving cache: {e}")
 
+    def get_menu_cache_key(self, menu_date: str) -> str:
+        """Scraped menus depend only on campus and date, so they are shared across preferences"""
+        return f"menu_{_cache_slug(self.campus_key)}_{menu_date}"
+
+    def get_cached_menu(self, menu_date: str) -> Optional[Dict[str, Dict[str, str]]]:
+        """Return the scraped menu for this campus/date from memory or disk, if we have it"""
+        cache_key = self.get_menu_cache_key(menu_date)
+        daily_menu = _MENU_CACHE.get(cache_key)
+        if daily_menu is not None:
+            return daily_menu
+
+        cache_file = os.path.join(self.cache_dir, f"{cache_key}.json")
+        try:
+            with open(cache_file, 'rb') as f:
+                daily_menu = orjson.loads(f.read())
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            if self.debug:
+                print(f"Error reading menu cache file: {e}")
+            return None
+
+        if self.debug:
+            print(f"Using cached menu for {self.campus_key} on {menu_date}")
+        self.remember_menu(cache_key, menu_date, daily_menu)
+        return daily_menu
+
+    def remember_menu(self, cache_key: str, menu_date: str, daily_menu: Dict[str, Dict[str, str]]):
+        """Keep the menu in memory, evicting menus for any other date so the cache doesn't grow day after day"""
+        with _MENU_CACHE_LOCK:
+            for stale_key in [key for key in _MENU_CACHE if not key.endswith(f"_{menu_date}")]:
+                del _MENU_CACHE[stale_key]
+            _MENU_CACHE[cache_key] = daily_menu
+
+    def save_cached_menu(self, menu_date: str, daily_menu: Dict[str, Dict[str, str]]):
+        """Persist the scraped menu, writing to a temp file first so readers never see a partial file"""
+        cache_key = self.get_menu_cache_key(menu_date)
+        self.remember_menu(cache_key, menu_date, daily_menu)
+
+        cache_file = os.path.join(self.cache_dir, f"{cache_key}.json")
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            with tempfile.NamedTemporaryFile('wb', dir=self.cache_dir, suffix='.tmp', delete=False) as f:
+                f.write(orjson.dumps(daily_menu))
+            os.replace(f.name, cache_file)
+        except Exception as e:
+            if self.debug:
+                print(f"Error saving menu cache: {e}")
+
     def get_initial_form_data(self) -> Optional[Dict[str, Dict[str, str]]]:
+        # The campus/meal/date dropdowns are the same for every request, so reuse them within the TTL.
+        # The date list rolls over at midnight, so a copy fetched on an earlier day is only reused while the site
+        # is failing (start_meal_fetches then falls back to its first listed date).
+        today = datetime.now().date()
+        if _form_cache_hit(today):
+            return _FORM_CACHE['v']
+        
+        with _FORM_CACHE_LOCK:
+            # Another thread may have refreshed the cache (or failed to) while this one waited for the lock
+            if _form_cache_hit(today):
+                return _FORM_CACHE['v']
+            return self.refresh_form_data(today)
+
+    def refresh_form_data(self, today) -> Optional[Dict[str, Dict[str, str]]]:
+        """Fetch (or revalidate) the PSU form page and update _FORM_CACHE. Callers hold _FORM_CACHE_LOCK."""
+        now = time.monotonic()
+        headers = {}
+        if _FORM_CACHE['v']:
+            if _FORM_CACHE['etag']: headers['If-None-Match'] = _FORM_CACHE['etag']
+            if _FORM_CACHE['last_modified']: headers['If-Modified-Since'] = _FORM_CACHE['last_modified']
+        
         try:
-            response = self.session.get(self.base_url, timeout=30)
+            response = self.session.get(self.base_url, headers=headers, timeout=30)
             response.raise_for_status()
-            soup = BeautifulSoup(response.content, 'html.parser')
+            if response.status_code == 304 and _FORM_CACHE['v']:
+                # Unchanged since the last fetch; keep the parsed options and restart the TTL
+                _FORM_CACHE['t'], _FORM_CACHE['day'] = now, today
+                return _FORM_CACHE['v']
             
+            # Stream the page and only look at the three <select> elements instead of building a full tree
             options = {'campus': {}, 'meal': {}, 'date': {}}
-            for name in options.keys():
-                select_tag = soup.find('select', {'name': f'sel{name.capitalize()}' if name != 'date' else 'selMenuDate'})
-                if select_tag:
-                    for option in select_tag.find_all('option'):
-                        value = option.get('value', '').strip()
-                        text = option.get_text(strip=True)
+            for _, select_tag in etree.iterparse(io.BytesIO(response.content), html=True, tag='select'):
+                name = _FORM_SELECT_NAMES.get(select_tag.get('name'))
+                if name and not options[name]:
+                    for option in select_tag.iter('option'):
+                        value = (option.get('value') or '').strip()
+                        text = ''.join(part.strip() for part in option.itertext())
                         if value and text:
                             options[name][text.lower()] = value
+                select_tag.clear()
             
             if self.debug:
                 print("Available campus options:")
                 for name, val in options['campus'].items():
                     print(f"  {name}: {val}")
             
-            return options
-        except requests.RequestException as e:
+            # A page without the campus dropdown (maintenance page, truncated body) is never cached
+            if options['campus']:
+                _FORM_CACHE['campus_matches'] = (options['campus'], {key: _match_campus(options['campus'], terms)
+                                                                     for key, terms in _CAMPUS_SEARCH_TERMS.items()})
+                _FORM_CACHE['t'], _FORM_CACHE['v'], _FORM_CACHE['day'] = now, options, today
+                _FORM_CACHE['etag'] = response.headers.get('ETag')
+                _FORM_CACHE['last_modified'] = response.headers.get('Last-Modified')
+                return options
+            if self.debug: print("Initial page had no campus options")
+        except (requests.RequestException, etree.XMLSyntaxError) as e:
+            # iterparse raises XMLSyntaxError on an empty or non-HTML body
             if self.debug: print(f"Error fetching initial page: {e}")
-            return None
+        
+        # Keep serving the last good copy (even an earlier day's) and back off before trying the site again
+        _FORM_CACHE['failed_at'] = now
+        return _FORM_CACHE['v']
 
     def looks_like_food_item(self, text: str) -> bool:
-        if not text or len(text.strip()) < 3 or len(text.strip()) > 70: return False
-        text_lower = text.lower()
-        non_food_keywords = [
-            'select', 'menu', 'date', 'campus', 'print', 'view', 'nutrition', 'allergen',
-            'feedback', 'contact', 'hours', 'location', 'penn state', 'altoona', 
-            'port sky', 'cafe', 'kitchen', 'station', 'grill', 'deli', 'market',
-            'made to order', 'action', 'no items', 'not available', 'closed'
-        ]
-        if any(keyword in text_lower for keyword in non_food_keywords): return False
-        if not any(c.isalpha() for c in text): return False
+        if not text or not _MIN_ITEM_NAME_LEN <= len(text.strip()) <= _MAX_ITEM_NAME_LEN: return False
+        if _NON_FOOD_RE.search(text): return False
+        if not _HAS_ALPHA_RE.search(text): return False
         return True
 
-    def extract_items_from_meal_page(self, soup: BeautifulSoup) -> Dict[str, str]:
+    def resolve_url(self, href: str) -> str:
+        """urljoin(base_url, href.strip()), with plain concatenation for simple relative paths"""
+        href = href.strip()
+        if _SIMPLE_HREF_RE.fullmatch(href):
+            return (_BASE_ORIGIN if href[0] == '/' else _BASE_DIR) + href
+        # Schemes, dot segments, empty segments, ';' params, whitespace/control characters and empty
+        # queries/fragments are all rewritten by urljoin, so those go through it
+        return urljoin(self.base_url, href)
+
+    def extract_items_from_meal_page(self, content: bytes) -> Dict[str, str]:
+        items = self.extract_items_with_regex(content)
+        return items if items is not None else self.extract_items_with_soup(content)
+
+    def extract_items_with_regex(self, content: bytes) -> Optional[Dict[str, str]]:
+        """Read plain-text links straight from the bytes. Returns None if any <a href> on the page isn't one, or the
+        page isn't UTF-8, since the regex can't read those and the page then needs a real parse."""
+        content = _UNPARSED_BLOCK_RE.sub(b'', content)
+        if _UNPARSED_OPEN_RE.search(content):
+            return None
+        matches = _ANCHOR_RE.findall(content)
+        if len(matches) != len(_ANCHOR_OPEN_RE.findall(content)):
+            return None
+        
         items = {}
+        is_food, resolve, unescape = self.looks_like_food_item, self.resolve_url, html.unescape
+        try:
+            for double_quoted, single_quoted, unquoted, raw_text in matches:
+                text = unescape(raw_text.decode('utf-8')).strip()
+                # Cheap length reject first; most nav/footer links never reach the keyword checks
+                if _MIN_ITEM_NAME_LEN <= len(text) <= _MAX_ITEM_NAME_LEN and is_food(text):
+                    href = double_quoted or single_quoted or unquoted
+                    items[text] = resolve(unescape(href.decode('utf-8')))
+        except UnicodeDecodeError:
+            # A legacy charset (cp1252, Latin-1); BeautifulSoup detects it instead of dropping the bytes
+            return None
+        return items
+
+    def extract_items_with_soup(self, content: bytes) -> Dict[str, str]:
+        """Parse the page with lxml, materializing only the <a href> elements"""
+        items = {}
+        soup = BeautifulSoup(content, 'lxml', parse_only=_ANCHOR_STRAINER)
         for a_tag in soup.find_all('a', href=True):
             text = a_tag.get_text(strip=True)
             if self.looks_like_food_item(text):
                 relative_url = a_tag['href']
-                full_url = urljoin(self.base_url, relative_url)
+                full_url = self.resolve_url(relative_url)
                 items[text] = full_url
         return items
 
-    def fetch_single_meal(self, meal_name: str, meal_value: str, campus_value: str, date_value: str) -> Tuple[str, Dict[str, str]]:
-        """Fetch a single meal's menu data. Returns (meal_name, items_dict) or (meal_name, {}) on error."""
+    def fetch_single_meal(self, meal_name: str, meal_value: str, campus_value: str, date_value: str) -> Tuple[str, Optional[Dict[str, str]]]:
+        """Fetch a single meal's menu data. Returns (meal_name, items_dict), or (meal_name, None) if the request failed."""
         try:
             form_data = {'selCampus': campus_value, 'selMeal': meal_value, 'selMenuDate': date_value}
             if self.debug: print(f"Fetching menu for {meal_name} with data: {form_data}")
             
             response = self.session.post(self.base_url, data=form_data, timeout=30)
             response.raise_for_status()
-            meal_soup = BeautifulSoup(response.content, 'html.parser')
-            items = self.extract_items_from_meal_page(meal_soup)
+            items = self.extract_items_from_meal_page(response.content)
             
             if items:
                 if self.debug: print(f"Found {len(items)} items for {meal_name}.")
@@ -181,55 +615,73 @@ class MenuAnalyzer:
                 
         except requests.RequestException as e:
             if self.debug: print(f"Error fetching {meal_name} menu: {e}")
-            return meal_name, {}
+            return meal_name, None
 
     def find_campus_value(self, campus_options: Dict[str, str]) -> Tuple[Optional[str], str]:
         """Find the correct campus value based on the campus key"""
         campus_key_lower = self.campus_key.lower()
         
-        # Mapping of our campus keys to search terms
-        search_terms = {
-            'altoona-port-sky': ['altoona', 'port sky'],
-            'beaver-brodhead': ['beaver', 'brodhead'],
-            'behrend-brunos': ['behrend', 'bruno'],
-            'behrend-dobbins': ['behrend', 'dobbins'],
-            'berks-tullys': ['berks', 'tully'],
-            'brandywine-blue-apple': ['brandywine', 'blue apple'],
-            'greater-allegheny-cafe-metro': ['greater allegheny', 'cafe metro'],
-            'harrisburg-stacks': ['harrisburg', 'stacks'],
-            'harrisburg-outpost': ['harrisburg', 'outpost'],
-            'hazleton-highacres': ['hazleton', 'highacres'],
-            'mont-alto-mill': ['mont alto', 'mill'],
-            'up-east-findlay': ['east', 'findlay'],
-            'up-north-warnock': ['north', 'warnock'],
-            'up-pollock': ['pollock'],
-            'up-south-redifer': ['south', 'redifer'],
-            'up-west-waring': ['west', 'waring']
-        }
-        
-        terms = search_terms.get(campus_key_lower, [campus_key_lower])
-        
-        # Try to find exact matches first
-        for name, value in campus_options.items():
-            if all(term in name for term in terms):
-                return value, name
-        
-        # Try partial matches
-        for name, value in campus_options.items():
-            if any(term in name for term in terms):
-                return value, name
-        
-        return None, ""
+        # Our campus keys were resolved once when the cached copy of the form was parsed
+        matched_options, matches = _FORM_CACHE['campus_matches']
+        if campus_options is matched_options and campus_key_lower in matches:
+            return matches[campus_key_lower]
+        
+        return _match_campus(campus_options, _CAMPUS_SEARCH_TERMS.get(campus_key_lower, (campus_key_lower,)))
 
     def run_analysis(self) -> Dict[str, List[Tuple[str, int, str, str]]]:
-        # Get current date for caching (with version to force refresh)
-        today_str_key = datetime.now().strftime('%A, %B %d').lower() + "_v2"
+        # Get current date for the menu lookup; cached results also carry the version to force a refresh
+        today_str_key = datetime.now().strftime('%A, %B %d').lower()
+        result_key = f"{today_str_key}_v{_CACHE_VERSION}"
         
         # Check cache first
-        cached_result = self.get_cached_result(today_str_key)
+        cached_result = self.get_cached_result(result_key)
         if cached_result:
             return cached_result
         
+        if not self.gemini_api_key:
+            raise Exception("Gemini API key is required but not provided. Please check your configuration.")
+        
+        menu_date = datetime.now().strftime('%Y%m%d')
+        daily_menu = self.get_cached_menu(menu_date)
+        scraping = daily_menu is None
+        if scraping:
+            # Each meal's Gemini call starts as soon as its own page is scraped instead of waiting for all three
+            daily_menu = self.start_meal_fetches(today_str_key)
+        
+        try:
+            analyzed_results = self.analyze_menu_with_gemini(daily_menu)
+        finally:
+            if scraping:
+                daily_menu = {meal: future.result() for meal, future in daily_menu.items()}
+                # None marks a page that failed to load, as opposed to a meal with no items; a menu missing one
+                # is only good for this request, and the next one should scrape again
+                failed_meals = [meal for meal, items in daily_menu.items() if items is None]
+                daily_menu = {meal: items or {} for meal, items in daily_menu.items()}
+                if failed_meals:
+                    self.menu_complete = False
+                    logger.warning("Could not fetch %s for %s; not caching this menu", ", ".join(failed_meals), self.campus_key)
+                elif any(daily_menu.values()):
+                    self.save_cached_menu(menu_date, daily_menu)
+        
+        # Only known once every page has been scraped; an all-empty analysis must not be cached for the day
+        if not any(daily_menu.values()):
+            raise Exception("Failed to scrape any menu items from the website. Please try again later.")
+        
+        final_results = {}
+        for meal, items in analyzed_results.items():
+            # First, apply the hard filters based on user preferences
+            filtered_items = self.apply_hard_filters(items)
+            # Since we're now asking for top 5 directly, we don't need to slice further
+            final_results[meal] = filtered_items
+        
+        # Save to cache
+        if self.menu_complete:
+            self.save_cached_result(result_key, final_results)
+        
+        return final_results
+
+    def start_meal_fetches(self, today_str_key: str) -> Dict[str, Future]:
+        """Start scraping today's Breakfast/Lunch/Dinner items for this campus. Returns {meal: future of {item: url}}."""
         if self.debug: 
             print(f"Fetching initial form options for campus: {self.campus_key}")
         
@@ -252,68 +704,44 @@ class MenuAnalyzer:
             if date_options:
                 first_available_date = list(date_options.keys())[0]
                 date_value = list(date_options.values())[0]
-                print(f"Warning: Today's menu ('{today_str_key}') not found. Using first available date: {first_available_date}")
+                logger.warning("Today's menu (%r) not found. Using first available date: %s", today_str_key, first_available_date)
             else:
                 raise Exception("No dates found. Please try again later.")
 
-        daily_menu = {}
+        meal_futures = {}
         meal_options = form_options.get('meal', {})
         
-        # Prepare meal data for concurrent execution
-        meal_tasks = []
         for meal_name in ["Breakfast", "Lunch", "Dinner"]:
             meal_key = meal_name.lower()
             meal_value = meal_options.get(meal_key)
             
             if not meal_value:
                 if self.debug: print(f"Could not find form value for '{meal_name}'. Skipping.")
-                daily_menu[meal_name] = {}
+                meal_futures[meal_name] = Future()
+                meal_futures[meal_name].set_result({})
                 continue
             
-            meal_tasks.append((meal_name, meal_value))
+            # Submit to the shared pool so threads aren't spun up per request
+            meal_futures[meal_name] = _SCRAPE_POOL.submit(self.fetch_meal_items, meal_name, meal_value, campus_value, date_value)
         
-        # Execute meal fetching concurrently
-        if meal_tasks:
-            if self.debug: print(f"Fetching {len(meal_tasks)} meals concurrently...")
-            
-            with ThreadPoolExecutor(max_workers=3) as executor:
-                # Submit all tasks
-                future_to_meal = {
-                    executor.submit(self.fetch_single_meal, meal_name, meal_value, campus_value, date_value): meal_name
-                    for meal_name, meal_value in meal_tasks
-                }
-                
-                # Collect results as they complete
-                for future in as_completed(future_to_meal):
-                    meal_name = future_to_meal[future]
-                    try:
-                        result_meal_name, items = future.result()
-                        daily_menu[result_meal_name] = items
-                    except Exception as e:
-                        if self.debug: print(f"Unexpected error fetching {meal_name}: {e}")
-                        daily_menu[meal_name] = {}
+        if self.debug: print(f"Fetching {len(meal_futures)} meals concurrently...")
+        return meal_futures
 
-        if not daily_menu:
-            raise Exception("Failed to scrape any menu items from the website. Please try again later.")
-        
-        if not self.gemini_api_key:
-            raise Exception("Gemini API key is required but not provided. Please check your configuration.")
-        
-        analyzed_results = self.analyze_menu_with_gemini(daily_menu)
-        
-        final_results = {}
-        for meal, items in analyzed_results.items():
-            # First, apply the hard filters based on user preferences
-            filtered_items = self.apply_hard_filters(items)
-            # Since we're now asking for top 5 directly, we don't need to slice further
-            final_results[meal] = filtered_items
-        
-        # Save to cache
-        self.save_cached_result(today_str_key, final_results)
-        
-        return final_results
+    def fetch_meal_items(self, meal_name: str, meal_value: str, campus_value: str, date_value: str) -> Optional[Dict[str, str]]:
+        """fetch_single_meal for the scrape pool: never raises, so one bad page can't fail the whole analysis.
+        Returns None (rather than {}) when the page couldn't be fetched."""
+        try:
+            return self.fetch_single_meal(meal_name, meal_value, campus_value, date_value)[1]
+        except Exception as e:
+            if self.debug: print(f"Unexpected error fetching {meal_name}: {e}")
+            return None
+
+    def analyze_menu_with_gemini(self, daily_menu: Dict[str, Union[Dict[str, str], Future]]) -> Dict[str, List[Tuple[str, int, str, str]]]:
+        """Score every meal with Gemini, issuing the per-meal requests concurrently. Meals may still be scraping (Futures)."""
+        future = asyncio.run_coroutine_threadsafe(self.analyze_menu_with_gemini_async(daily_menu), _get_gemini_loop())
+        return future.result()
 
-    def analyze_menu_with_gemini(self, daily_menu: Dict[str, Dict[str, str]]) -> Dict[str, List[Tuple[str, int, str, str]]]:
+    async def analyze_menu_with_gemini_async(self, daily_menu: Dict[str, Union[Dict[str, str], Future]]) -> Dict[str, List[Tuple[str, int, str, str]]]:
         exclusions = []
         if self.exclude_beef: exclusions.append("No beef.")
         if self.exclude_pork: exclusions.append("No pork.")
@@ -322,20 +750,38 @@ class MenuAnalyzer:
         restrictions_text = " ".join(exclusions) if exclusions else "None."
 
         priority_instruction = ("prioritize PROTEIN content" if self.prioritize_protein else "prioritize a BALANCE of high protein and healthy preparation")
-        
-        menu_for_prompt = {meal: list(items.keys()) for meal, items in daily_menu.items()}
 
-        # Ask for top 5 options per meal, with special handling for CYO items
+        # All requests share one semaphore, so concurrent analyses together stay under the Gemini rate limit
+        session = await _get_gemini_session()
+
+        meal_results = await asyncio.gather(*[
+            self.score_meal_with_gemini(session, _gemini_semaphore, meal, items, priority_instruction, restrictions_text)
+            for meal, items in daily_menu.items() if items or isinstance(items, Future)
+        ])
+
+        results = dict(meal_results)
+        return {meal: results.get(meal, []) for meal in daily_menu}
+
+    async def score_meal_with_gemini(self, session: 'aiohttp.ClientSession', semaphore: asyncio.Semaphore, meal: str,
+                                     items: Union[Dict[str, str], Future], priority_instruction: str,
+                                     restrictions_text: str) -> Tuple[str, List[Tuple[str, int, str, str]]]:
+        """Ask Gemini for the top options of a single meal. Returns (meal, results)."""
+        if isinstance(items, Future):
+            items = await asyncio.wrap_future(items)
+            if not items:
+                return meal, []
+        
+        # Ask for top 5 options for this meal, with special handling for CYO items
         prompt = f"""
-        Analyze the menu below. Your goal is to {priority_instruction}. My restrictions are: {restrictions_text}
-        For EACH meal, identify the top 5 options.
+        Analyze the {meal} menu below. Your goal is to {priority_instruction}. My restrictions are: {restrictions_text}
+        Identify the top 5 options.
         
         CRITICAL RULES:
         - ONLY select items that appear EXACTLY as listed in the menu below
         - DO NOT create any variations, modifications, or "High Protein" versions
         - DO NOT add "(High Protein)" or any other suffixes to item names
         - For CYO items, explain in the reasoning how to customize them for high protein
-        - Select exactly 5 items per meal category (Breakfast, Lunch, Dinner)
+        - Select exactly 5 items
         
         Example of CORRECT format:
         "food_name": "CYO Omelet"
@@ -344,61 +790,109 @@ class MenuAnalyzer:
         Example of INCORRECT format:
         "food_name": "CYO Omelet (High Protein)"  // DO NOT DO THIS
         
-        Return your response as a single, valid JSON object with keys "Breakfast", "Lunch", "Dinner". Each value should be a list of objects, each with "food_name", "score" (0-100), and "reasoning".
-        Menu: {json.dumps(menu_for_prompt, indent=2)}
+        Return your response as a single, valid JSON object with the key "{meal}". Its value should be a list of objects, each with "food_name", "score" (0-100), and "reasoning".
+        Menu: {orjson.dumps(list(items.keys())).decode()}
         """
         
+        scored_items = await self.request_gemini_scores_shared(session, semaphore, meal, prompt)
+        
+        # Attach this campus's nutrition links; shared results only carry names, scores and reasoning
+        url_for = items.get
+        meal_results = sorted(((food_name, score, reasoning, url_for(food_name, '#')) for food_name, score, reasoning in scored_items),
+                              key=itemgetter(1), reverse=True)
+        return meal, meal_results
+
+    async def request_gemini_scores_shared(self, session: 'aiohttp.ClientSession', semaphore: asyncio.Semaphore,
+                                           meal: str, prompt: str) -> List[Tuple[str, int, str]]:
+        """Reuse recent scores for an identical prompt, and coalesce identical in-flight prompts into a single Gemini call"""
+        # The model is part of the key so switching models never serves another model's scores
+        prompt_key = hashlib.blake2b(f"{_GEMINI_MODEL}\0{prompt}".encode(), digest_size=16).hexdigest()
+        with _GEMINI_INFLIGHT_LOCK:
+            cached = _GEMINI_RESULTS.get(prompt_key)
+            if cached and time.monotonic() - cached[0] < _GEMINI_RESULTS_TTL:
+                if self.debug: print(f"Using cached Gemini scores for {meal}")
+                return cached[1]
+            shared = _GEMINI_INFLIGHT.get(prompt_key)
+            is_owner = shared is None
+            if is_owner:
+                shared = _GEMINI_INFLIGHT[prompt_key] = Future()
+        
+        if not is_owner:
+            if self.debug: print(f"Joining in-flight Gemini request for {meal}")
+            return await asyncio.wrap_future(shared)
+        
+        try:
+            scored_items = await self.request_gemini_scores(session, semaphore, meal, prompt)
+            with _GEMINI_INFLIGHT_LOCK:
+                _GEMINI_RESULTS[prompt_key] = (time.monotonic(), scored_items)
+                while len(_GEMINI_RESULTS) > _GEMINI_RESULTS_MAX_ENTRIES:
+                    # Dicts keep insertion order, so the first key is the oldest entry
+                    _GEMINI_RESULTS.pop(next(iter(_GEMINI_RESULTS)))
+            shared.set_result(scored_items)
+            return scored_items
+        except Exception as e:
+            shared.set_exception(e)
+            raise
+        finally:
+            with _GEMINI_INFLIGHT_LOCK:
+                _GEMINI_INFLIGHT.pop(prompt_key, None)
+
+    async def request_gemini_scores(self, session: 'aiohttp.ClientSession', semaphore: asyncio.Semaphore,
+                                    meal: str, prompt: str) -> List[Tuple[str, int, str]]:
+        """Send one meal prompt to Gemini with retries. Returns [(food_name, score, reasoning), ...]."""
         # Retry mechanism with exponential backoff
         max_retries = 5  # Increased retries for better reliability
         base_delay = 2   # Increased base delay
-        retry_attempted = False
+        # Encode the request body once with orjson; retries resend the same bytes
+        payload = orjson.dumps({"contents": [{"parts": [{"text": prompt}]}]})
         
         for attempt in range(max_retries):
             try:
-                if self.debug: print(f"Gemini API attempt {attempt + 1}/{max_retries}")
+                if self.debug: print(f"Gemini API attempt {attempt + 1}/{max_retries} for {meal}")
                 
-                response = self.session.post(
-                    self.gemini_url, 
-                    headers={"Content-Type": "application/json"}, 
-                    json={"contents": [{"parts": [{"text": prompt}]}]}, 
-                    timeout=60
-                )
-                response.raise_for_status()
-                data = response.json()
-                text_response = data["candidates"][0]["content"]["parts"][0]["text"]
-                json_str = re.search(r'\{.*\}', text_response, re.DOTALL).group(0)
-                parsed_json = json.loads(json_str)
-
-                results = {}
-                for meal, analyzed_items in parsed_json.items():
-                    meal_results = []
-                    for item_info in analyzed_items:
-                        food_name = item_info.get("food_name")
-                        
-                        # Skip items with "(High Protein)" suffix as they don't exist in the menu
-                        if "(High Protein)" in food_name:
-                            continue
-                            
-                        url = daily_menu.get(meal, {}).get(food_name, '#')
-                        meal_results.append((food_name, item_info.get("score"), item_info.get("reasoning"), url))
-                    meal_results.sort(key=lambda x: x[1], reverse=True)
-                    results[meal] = meal_results
-                return results
+                async with semaphore:
+                    async with session.post(
+                        self.gemini_url,
+                        headers={"Content-Type": "application/json", "x-goog-api-key": self.gemini_api_key},
+                        data=payload
+                    ) as response:
+                        response.raise_for_status()
+                        text_response = await self.read_gemini_stream(response)
+                parsed_json = _extract_json(text_response)
+
+                scored_items = []
+                for item_info in parsed_json.get(meal, []):
+                    food_name = item_info.get("food_name")
+                    if not isinstance(food_name, str):
+                        raise ValueError(f"Gemini returned an item without a food_name: {item_info!r}")
+                    
+                    # Skip items with "(High Protein)" suffix as they don't exist in the menu
+                    if "(High Protein)" in food_name:
+                        continue
+                    
+                    # A missing or non-numeric score raises here, so the reply is retried instead of cached
+                    score = int(item_info.get("score"))
+                    scored_items.append((food_name, score, item_info.get("reasoning")))
+                return scored_items
                 
             except Exception as e:
-                if self.debug: print(f"Gemini analysis attempt {attempt + 1} failed: {e}")
+                if self.debug: print(f"Gemini analysis attempt {attempt + 1} for {meal} failed: {e}")
                 
                 # If it's the last attempt, raise the exception
                 if attempt == max_retries - 1:
                     raise Exception(f"Gemini API analysis failed after {max_retries} attempts: {str(e)}")
                 
+                # A truncated or malformed reply is worth asking again straight away
+                if isinstance(e, (AttributeError, TypeError, ValueError)):
+                    continue
+                
                 # Check for retryable errors
                 error_str = str(e).lower()
-                if any(keyword in error_str for keyword in ["503", "service unavailable", "overloaded", "rate limit", "quota exceeded"]):
-                    retry_attempted = True
+                status = getattr(e, 'status', None)
+                if status in (429, 503) or any(keyword in error_str for keyword in ["503", "service unavailable", "overloaded", "rate limit", "quota exceeded"]):
                     delay = base_delay * (2 ** attempt)  # Exponential backoff
                     if self.debug: print(f"Retryable error detected: {e}. Waiting {delay} seconds before retry...")
-                    time.sleep(delay)
+                    await asyncio.sleep(delay)
                 else:
                     # For other errors, don't retry
                     raise Exception(f"Gemini API analysis failed: {str(e)}")
@@ -406,28 +900,31 @@ class MenuAnalyzer:
         # This should never be reached, but just in case
         raise Exception("Unexpected error in retry loop")
 
+    async def read_gemini_stream(self, response: 'aiohttp.ClientResponse') -> str:
+        """Collect the model text from a streamGenerateContent SSE response, decoding each event as it arrives"""
+        text_parts = []
+        async for line in response.content:
+            if not line.startswith(b"data:"):
+                continue
+            event = orjson.loads(line[5:])
+            for candidate in event.get("candidates", [])[:1]:
+                for part in candidate.get("content", {}).get("parts", []):
+                    text_parts.append(part.get("text", ""))
+        return "".join(text_parts)
+
     def apply_hard_filters(self, food_items: List[Tuple[str, int, str, str]]) -> List[Tuple[str, int, str, str]]:
-        if not (self.exclude_beef or self.exclude_pork or self.vegetarian or self.vegan): 
+        if self.exclusion_re is None:
             return food_items
-        filtered_list = []
-        for food, score, reason, url in food_items:
-            item_lower = food.lower()
-            excluded = False
-            if self.exclude_beef and "beef" in item_lower: excluded = True
-            if self.exclude_pork and any(p in item_lower for p in ["pork", "bacon", "sausage", "ham"]): excluded = True
-            if self.vegetarian and any(m in item_lower for m in ["beef", "pork", "chicken", "turkey", "fish", "salmon", "tuna", "bacon", "sausage", "ham"]): excluded = True
-            if self.vegan and any(m in item_lower for m in ["beef", "pork", "chicken", "turkey", "fish", "salmon", "tuna", "bacon", "sausage", "ham", "egg", "eggs", "dairy", "milk", "cheese", "butter", "yogurt"]): excluded = True
-            if not excluded:
-                filtered_list.append((food, score, reason, url))
-        return filtered_list
+        search = self.exclusion_re.search
+        return [item for item in food_items if not search(item[0])]
 
 
 # --- Routes ---
-@app.route('/')
+@pages_bp.route('/')
 def index():
     return send_from_directory('.', 'index.html')
 
-@app.route('/health')
+@pages_bp.route('/health')
 def health_check():
     return jsonify({
         'status': 'healthy',
@@ -435,77 +932,258 @@ def health_check():
         'version': '1.0.0'
     })
 
-@app.route('/api/clear-cache', methods=['POST'])
+@api_bp.route('/clear-cache', methods=['POST'])
 def clear_cache():
     try:
-        data = request.json
+        data = _read_json_object() or {}
         password = data.get('password', '')
+        if not isinstance(password, str):
+            password = ''
         
-        if password != 'admin2264':
+        # Constant-time comparison; an unset ADMIN_TOKEN disables the endpoint entirely
+        admin_token = os.getenv('ADMIN_TOKEN', '')
+        if not admin_token or not hmac.compare_digest(password.encode('utf-8'), admin_token.encode('utf-8')):
             return jsonify({"error": "Invalid password"}), 401
         
-        # Clear cache directory
-        import shutil
-        if os.path.exists("cache"):
-            shutil.rmtree("cache")
-            os.makedirs("cache")
+        # Clear cache directory: swap in an empty one now and unlink the old files in the background
+        with _MENU_CACHE_LOCK:
+            _MENU_CACHE.clear()
+        with _RESPONSE_CACHE_LOCK:
+            _RESPONSE_CACHE.clear()
+        with _GEMINI_INFLIGHT_LOCK:
+            _GEMINI_RESULTS.clear()
+        if os.path.exists(_CACHE_DIR):
+            trash_dir = f"{_CACHE_DIR}.trash.{uuid.uuid4().hex}"
+            os.rename(_CACHE_DIR, trash_dir)
+            os.makedirs(_CACHE_DIR, exist_ok=True)
+            threading.Thread(target=shutil.rmtree, args=(trash_dir, True), daemon=True).start()
             return jsonify({"message": "Cache cleared successfully"})
         else:
             return jsonify({"message": "No cache to clear"})
             
     except Exception as e:
-        print(f"[CACHE CLEAR ERROR] {e}")
+        logger.error("Cache clear failed: %s", e)
         return jsonify({"error": "Failed to clear cache"}), 500
 
-@app.route('/api/analyze', methods=['POST'])
+def _cached_json_response(body: bytes, etag: str):
+    """Build a JSON response tagged with an ETag, or an empty 304 if the client already has this body"""
+    # Quality-aware, so 'gzip;q=0' is honoured as a refusal
+    use_gzip = request.accept_encodings['gzip'] > 0
+    # The gzip and identity bodies are different representations, so they get different strong tags
+    if use_gzip:
+        etag += '-gz'
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    elif use_gzip:
+        # Level 1 is nearly free on CPU and still shrinks the JSON several-fold
+        response = current_app.response_class(gzip.compress(body, compresslevel=1), mimetype='application/json')
+        response.headers['Content-Encoding'] = 'gzip'
+    else:
+        response = current_app.response_class(body, mimetype='application/json')
+    response.set_etag(etag)
+    response.vary.add('Accept-Encoding')
+    return response
+
+def _read_json_object() -> Optional[dict]:
+    """The request body as a JSON object, or None if it is missing, malformed or not an object"""
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else None
+
+def _payload_error(data: dict) -> Optional[str]:
+    """Check the shape of an analyze payload before any work is queued. Returns an error message or None."""
+    campus = data.get('campus', '')
+    if not isinstance(campus, str) or len(campus) > _MAX_CAMPUS_KEY_LEN:
+        return "campus must be a campus key string"
+    invalid = [name for name in _PREFERENCE_FLAGS if not isinstance(data.get(name, False), bool)]
+    if invalid:
+        return f"{', '.join(invalid)} must be true or false"
+    return None
+
+def _parse_preference_flags(data: dict) -> int:
+    """Pack the request's preference toggles into one bitmask (bit i = _PREFERENCE_FLAGS[i])"""
+    return sum(bool(data.get(name, False)) << i for i, name in enumerate(_PREFERENCE_FLAGS))
+
+def _get_cached_response(cache_key: tuple) -> Optional[Tuple[bytes, str]]:
+    """Return (body, etag) for an identical same-day request, if one is still cached"""
+    cached = _RESPONSE_CACHE.get(cache_key)
+    if cached and time.time() - cached[0] < _RESPONSE_CACHE_TTL:
+        return cached[1], cached[2]
+    return None
+
+def _run_analysis(analyzer: MenuAnalyzer) -> Tuple[Dict[str, List[Tuple[str, int, str, str]]], bool]:
+    """Run one analysis. Returns (recommendations, whether every meal page loaded and the result may be cached)."""
+    return analyzer.run_analysis(), analyzer.menu_complete
+
+def _start_analysis(campus: str, flags: int, cache_key: tuple) -> Future:
+    """Start an analysis on the shared pool, or join the one already running for the same key.
+    The future resolves to _run_analysis's (recommendations, complete)."""
+    with _ANALYSIS_INFLIGHT_LOCK:
+        future = _ANALYSIS_INFLIGHT.get(cache_key)
+        if future is None:
+            analyzer = MenuAnalyzer(
+                campus_key=campus,
+                gemini_api_key=_GEMINI_API_KEY,
+                # The analyzer's step-by-step trace only runs when debug logging is on
+                debug=logger.isEnabledFor(logging.DEBUG),
+                session=_HTTP_SESSION,
+                **{name: bool(flags >> i & 1) for i, name in enumerate(_PREFERENCE_FLAGS)}
+            )
+            
+            # Run on the shared pool so a stuck scrape/Gemini call can't hold this request past the deadline
+            future = _ANALYSIS_INFLIGHT[cache_key] = _ANALYSIS_POOL.submit(_run_analysis, analyzer)
+            future.add_done_callback(lambda _, key=cache_key: _ANALYSIS_INFLIGHT.pop(key, None))
+        else:
+            logger.debug("Joining in-flight analysis for %s", campus)
+    return future
+
+def _cache_response(cache_key: tuple, recommendations, store: bool = True) -> Tuple[bytes, str]:
+    """Serialize recommendations once and, if store, keep the bytes for identical requests. Returns (body, etag)."""
+    body = orjson.dumps(recommendations)
+    etag = hashlib.blake2b(body, digest_size=16).hexdigest()
+    if store:
+        with _RESPONSE_CACHE_LOCK:
+            _RESPONSE_CACHE[cache_key] = (time.time(), body, etag)
+            while len(_RESPONSE_CACHE) > _RESPONSE_CACHE_MAX_ENTRIES:
+                # Dicts keep insertion order, so the first key is the oldest entry
+                _RESPONSE_CACHE.pop(next(iter(_RESPONSE_CACHE)))
+    return body, etag
+
+def _analysis_error_message(e: Exception) -> str:
+    # Check if it's a Gemini API error and pass it through
+    if _GEMINI_ERROR_RE.search(str(e)):
+        return str(e)
+    else:
+        return "An internal server error occurred."
+
+def _analysis_error_response(e: Exception):
+    logger.exception("Analysis request failed: %s", e)
+    return jsonify({"error": _analysis_error_message(e)}), 500
+
+@api_bp.route('/analyze', methods=['POST'])
 def analyze():
     try:
-        data = request.json
-        print(f"Received request with data: {data}")
+        data = _read_json_object()
+        logger.debug("Received request with data: %s", data)
         
-        # Simple validation
+        # Reject malformed payloads before anything is scraped or queued
+        if data is None:
+            return jsonify({"error": "Request body must be a JSON object"}), 400
+        error = _payload_error(data)
+        if error:
+            return jsonify({"error": error}), 400
         campus = data.get('campus', 'altoona-port-sky')
-        vegetarian = data.get('vegetarian', False)
-        vegan = data.get('vegan', False)
-        exclude_beef = data.get('exclude_beef', False)
-        exclude_pork = data.get('exclude_pork', False)
-        prioritize_protein = data.get('prioritize_protein', False)
+        flags = _parse_preference_flags(data)
         
         # Validate that vegan and vegetarian aren't both selected
-        if vegan and vegetarian:
+        if flags & 0b11 == 0b11:
             return jsonify({"error": "Cannot be both vegan and vegetarian"}), 400
         
-        # Get API key from environment
-        api_key = os.getenv('GEMINI_API_KEY')
-
-        analyzer = MenuAnalyzer(
-            campus_key=campus,
-            gemini_api_key=api_key,
-            exclude_beef=exclude_beef,
-            exclude_pork=exclude_pork,
-            vegetarian=vegetarian,
-            vegan=vegan,
-            prioritize_protein=prioritize_protein,
-            debug=True
-        )
+        # Serve identical same-day requests straight from the serialized response cache
+        cache_key = (campus, flags, datetime.now().strftime('%Y%m%d'))
+        cached = _get_cached_response(cache_key)
+        if cached:
+            return _cached_json_response(*cached)
         
-        recommendations = analyzer.run_analysis()
-        print(f"Returning recommendations: {recommendations}")
+        future = _start_analysis(campus, flags, cache_key)
+        try:
+            recommendations, complete = future.result(timeout=_ANALYSIS_TIMEOUT)
+        except FuturesTimeoutError:
+            logger.warning("Analysis for %s exceeded %ss", campus, _ANALYSIS_TIMEOUT)
+            return jsonify({"error": "Menu analysis is taking longer than expected. Please try again shortly."}), 504
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Returning recommendations: %s", recommendations)
         
-        return jsonify(recommendations)
+        return _cached_json_response(*_cache_response(cache_key, recommendations, store=complete))
     except Exception as e:
-        print(f"[SERVER ERROR] {e}")
-        import traceback
-        traceback.print_exc()
+        return _analysis_error_response(e)
+
+@api_bp.route('/analyze_batch', methods=['POST'])
+def analyze_batch():
+    """Analyze several campuses with the same preferences in one round trip.
+    Returns {campus: recommendations}, with {campus: {"error": ...}} for any campus whose analysis failed."""
+    try:
+        data = _read_json_object()
+        logger.debug("Received batch request with data: %s", data)
         
-        # Check if it's a Gemini API error and pass it through
-        if "Gemini API" in str(e) or "503" in str(e) or "Service Unavailable" in str(e):
-            return jsonify({"error": str(e)}), 500
-        else:
-            return jsonify({"error": "An internal server error occurred."}), 500
+        if data is None:
+            return jsonify({"error": "Request body must be a JSON object"}), 400
+        error = _payload_error(data)
+        if error:
+            return jsonify({"error": error}), 400
+        campuses = data.get('campuses')
+        if (not isinstance(campuses, list) or not campuses
+                or not all(isinstance(c, str) and 0 < len(c) <= _MAX_CAMPUS_KEY_LEN for c in campuses)):
+            return jsonify({"error": "campuses must be a non-empty list of campus keys"}), 400
+        if len(campuses) > _BATCH_MAX_CAMPUSES:
+            return jsonify({"error": f"At most {_BATCH_MAX_CAMPUSES} campuses per batch"}), 400
+        campuses = list(dict.fromkeys(campuses))
+        
+        flags = _parse_preference_flags(data)
+        if flags & 0b11 == 0b11:
+            return jsonify({"error": "Cannot be both vegan and vegetarian"}), 400
+        
+        # Start every uncached campus before waiting on any, so the analyses run side by side
+        today = datetime.now().strftime('%Y%m%d')
+        pending = {}
+        bodies = {}
+        for campus in campuses:
+            cache_key = (campus, flags, today)
+            cached = _get_cached_response(cache_key)
+            if cached:
+                bodies[campus] = cached[0]
+            else:
+                pending[campus] = (cache_key, _start_analysis(campus, flags, cache_key))
+        
+        # One deadline for the whole batch, not one per campus
+        deadline = time.monotonic() + _ANALYSIS_TIMEOUT
+        for campus, (cache_key, future) in pending.items():
+            try:
+                recommendations, complete = future.result(timeout=max(0.0, deadline - time.monotonic()))
+            except FuturesTimeoutError:
+                # The analysis keeps running and will land in the cache; the finished campuses are still returned
+                logger.warning("Batch analysis for %s exceeded %ss", campus, _ANALYSIS_TIMEOUT)
+                bodies[campus] = orjson.dumps({"error": "Menu analysis is taking longer than expected. Please try again shortly."})
+                continue
+            except Exception as e:
+                # One failing campus shouldn't sink the others; report it in its own slot and don't cache it
+                logger.exception("Batch analysis for %s failed: %s", campus, e)
+                bodies[campus] = orjson.dumps({"error": _analysis_error_message(e)})
+                continue
+            bodies[campus] = _cache_response(cache_key, recommendations, store=complete)[0]
+        
+        # Splice the already-serialized per-campus bodies together instead of re-encoding them
+        body = b'{' + b','.join(orjson.dumps(campus) + b':' + bodies[campus] for campus in campuses) + b'}'
+        return _cached_json_response(body, hashlib.blake2b(body, digest_size=16).hexdigest())
+    except Exception as e:
+        return _analysis_error_response(e)
+
+def _warm_form_cache():
+    """Fetch the PSU form dropdowns once so the first request doesn't pay for the page load"""
+    MenuAnalyzer(campus_key='altoona-port-sky').get_initial_form_data()
+
+
+# --- Flask App Initialization ---
+def create_app() -> Flask:
+    app = Flask(__name__)
+    app.json = ORJSONProvider(app)
+    CORS(app)
+    app.register_blueprint(pages_bp)
+    app.register_blueprint(api_bp)
+    
+    # Build every preference combination's exclusion pattern up front and, in deployments, prefetch the form page
+    # off-thread
+    for flags in range(1 << len(_PREFERENCE_FLAGS)):
+        _exclusion_re(flags)
+    if _WARM_FORM_CACHE:
+        threading.Thread(target=_warm_form_cache, daemon=True).start()
+    return app
+
+
+app = create_app()
 
 
 if __name__ == '__main__':
     port = int(os.getenv('PORT', 5001))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    # Werkzeug's debugger and reloader are for local development only; opt in with FLASK_DEBUG=1
+    app.run(host='0.0.0.0', port=port, debug=os.getenv('FLASK_DEBUG') == '1')
 
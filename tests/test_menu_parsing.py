@@ -0,0 +1,86 @@
+from urllib.parse import urljoin
+
+import pytest
+
+from main import MenuAnalyzer
+
+# Trimmed copies of the markup served by the dining menu pages
+NAV = b'''<html><body><div id="nav"><a href="/">Home</a> <a href="shortmenu.aspx?sName=Penn+State">Menus</a></div>'''
+FOOT = b'''<div class="footer"><a href="https://psu.edu/contact">Contact Us</a></div></body></html>'''
+
+PAGES = {
+    'plain_links': NAV + b'''
+        <div class="shortmenurecipes"><a href="label.aspx?RecNumAndPort=100001*1">Grilled Chicken Breast</a></div>
+        <div class="shortmenurecipes"><a href='label.aspx?RecNumAndPort=100002*1'>Black Bean Burger</a></div>
+        <div class="shortmenurecipes"><a href="label.aspx?RecNumAndPort=100003*1">Mac &amp; Cheese</a></div>
+    ''' + FOOT,
+    'nested_span': NAV + b'''
+        <div class="shortmenurecipes"><a href="label.aspx?RecNumAndPort=200001*1"><span>Turkey Chili</span></a></div>
+        <div class="shortmenurecipes"><a href="label.aspx?RecNumAndPort=200002*1">Roasted Vegetables</a></div>
+    ''' + FOOT,
+    'unquoted_href': NAV + b'''
+        <div class="shortmenurecipes"><a href=label.aspx?RecNumAndPort=300001*1>Beef Tacos</a></div>
+        <div class="shortmenurecipes"><a href="label.aspx?RecNumAndPort=300002*1">Garden Salad</a></div>
+    ''' + FOOT,
+    'quote_in_href': NAV + b'''
+        <div class="shortmenurecipes"><a href="label.aspx?name=Chef's+Special">Chef's Pasta Primavera</a></div>
+        <div class="shortmenurecipes"><a href='label.aspx?name="Hot"+Wings'>Buffalo Chicken Wings</a></div>
+    ''' + FOOT,
+    'gt_in_attribute': NAV + b'''
+        <div class="shortmenurecipes"><a onclick="return x>y" href="label.aspx?RecNumAndPort=400001*1">Pork Fried Rice</a></div>
+        <div class="shortmenurecipes"><a href="label.aspx?RecNumAndPort=400002*1" title="a>b">Vegetable Lo Mein</a></div>
+    ''' + FOOT,
+    'comment_and_script': b'''<html><head><title>Menu</title>
+        <script>var tpl = '<a href="q">Fake Chicken Item</a>';</script></head><body>
+        <!-- <a href="label.aspx?x=1">Old Chicken</a> -->
+        <div class="shortmenurecipes"><a href="label.aspx?RecNumAndPort=500001*1">Baked Salmon</a></div>
+    ''' + FOOT,
+    'cp1252_text': NAV + b'''
+        <div class="shortmenurecipes"><a href="label.aspx?RecNumAndPort=600001*1">Chef\x92s Special Soup</a></div>
+        <div class="shortmenurecipes"><a href="label.aspx?RecNumAndPort=600002*1">Cr\xe8me Br\xfbl\xe9e</a></div>
+    ''' + FOOT,
+}
+
+
+@pytest.fixture
+def analyzer():
+    return MenuAnalyzer('up')
+
+
+@pytest.mark.parametrize('name', sorted(PAGES))
+def test_extraction_matches_full_parse(analyzer, name):
+    content = PAGES[name]
+    expected = analyzer.extract_items_with_soup(content)
+    assert expected
+    assert analyzer.extract_items_from_meal_page(content) == expected
+
+
+@pytest.mark.parametrize('name', sorted(PAGES))
+def test_regex_path_never_disagrees_with_full_parse(analyzer, name):
+    content = PAGES[name]
+    items = analyzer.extract_items_with_regex(content)
+    if items is not None:
+        assert items == analyzer.extract_items_with_soup(content)
+
+
+def test_links_in_comments_and_scripts_are_ignored(analyzer):
+    assert list(analyzer.extract_items_from_meal_page(PAGES['comment_and_script'])) == ['Baked Salmon']
+
+
+def test_legacy_charset_names_keep_their_accents(analyzer):
+    assert analyzer.extract_items_with_regex(PAGES['cp1252_text']) is None
+    assert set(analyzer.extract_items_from_meal_page(PAGES['cp1252_text'])) >= {
+        'Chef\u2019s Special Soup', 'Cr\u00e8me Br\u00fbl\u00e9e'}
+
+
+def test_regex_path_defers_on_nested_markup(analyzer):
+    assert analyzer.extract_items_with_regex(PAGES['nested_span']) is None
+    assert 'Turkey Chili' in analyzer.extract_items_from_meal_page(PAGES['nested_span'])
+
+
+@pytest.mark.parametrize('href', [
+    'label.aspx?RecNumAndPort=100001*1', '/menus/label.aspx?a=1&b=2#top', '  label.aspx\n', 'label\t.aspx',
+    'https://psu.edu/x', '//psu.edu/x', '?sName=1', '#top', 'a/.', 'a/..', '..', 'x.aspx?', 'x.aspx#', 'a//b', ';p',
+])
+def test_resolve_url_matches_urljoin(analyzer, href):
+    assert analyzer.resolve_url(href) == urljoin(analyzer.base_url, href.strip())